@@ -0,0 +1,139 @@
+import re
+import pandas as pd
+import numpy as np
+import argparse
+from pathlib import Path
+from screens import get_screen
+
+parser = argparse.ArgumentParser(
+                    prog='backtest',
+                    description='Evaluate screens over archived scratch analysis runs and report how stable their selections were')
+parser.add_argument("filenames", nargs="+", help="Archived scratch CSVs. The run date is taken from the YYYY-MM-DD in the file name and the rest of the name identifies the series of runs, e.g. the exchange")
+parser.add_argument("-s", "--screen", action="append", help="A screen to evaluate: the name of a predefined screen or name=expression, e.g. \"growers=`Growth 5Y/Y` > 0.05 and ROE > 0.1\". Can be given multiple times. Default: default")
+parser.add_argument("-o", "--output", metavar="PREFIX", help="Write PREFIX-churn.csv, PREFIX-spells.csv and PREFIX-survival.csv. If left empty, the churn and survival tables are printed")
+
+args = parser.parse_args()
+
+
+def load_snapshots(filenames):
+    """ Load all the runs into one frame indexed by (series, run date). The Outliers column is
+    not loaded, as it is only a record of the dividends.
+    """
+    snapshots = {}
+    for filename in filenames:
+        stem = Path(filename).stem
+        date = re.search(r"\d{4}-\d{2}-\d{2}", stem)
+        if date is None:
+            raise ValueError("No run date (YYYY-MM-DD) in the file name %s" % filename)
+        series = (stem[:date.start()] + stem[date.end():]).strip("-_")
+        snapshots[(series, pd.Timestamp(date.group()))] = pd.read_csv(filename, usecols=lambda c: c != "Outliers")
+    df = pd.concat(snapshots, names=["series", "run_date", None]).droplevel(-1)
+    return df.sort_index(level=["series", "run_date"], sort_remaining=False)
+
+
+def index_snapshots(df):
+    """ Return the (series, symbol) code and the run code, the position of the run within its
+    series, of every row along with the keys and the runs they refer to.
+    """
+    runs = df.index.unique().to_frame(index=False)
+    runs["run"] = runs.groupby("series").cumcount()
+    run_codes = runs.set_index(["series", "run_date"])["run"].reindex(df.index).to_numpy()
+    symbols = pd.DataFrame({ "series": df.index.get_level_values("series"), "Symbol": df["Symbol"].to_numpy() })
+    key_codes = symbols.groupby(["series", "Symbol"], sort=False).ngroup().to_numpy()
+    keys = symbols.drop_duplicates(ignore_index=True).copy()
+    keys["runs"] = keys["series"].map(runs.groupby("series")["run"].count())
+    return key_codes, run_codes, keys, runs
+
+
+def get_membership(selected, key_codes, run_codes, keys):
+    """ Return the key x run matrices of whether the symbol was selected, entered or exited the
+    selection in that run. Symbols missing from a run count as not selected and runs past the
+    last run of a series are never selected nor exited.
+    """
+    member = np.zeros((len(keys), keys["runs"].max()), dtype=bool)
+    member[key_codes[selected], run_codes[selected]] = True
+    valid = np.arange(member.shape[1]) < keys["runs"].to_numpy()[:, None]
+    previous = np.pad(member[:, :-1], ((0, 0), (1, 0)))
+    return member, member & ~previous, ~member & previous & valid
+
+
+def get_churn(member, entered, exited, keys, runs):
+    """ Members, entries, exits and turnover (exits over the previous run's members) per run.
+    """
+    frames = []
+    for series, series_runs in runs.groupby("series"):
+        rows = (keys["series"] == series).to_numpy()
+        frames.append(pd.DataFrame({
+            "series": series,
+            "run_date": series_runs["run_date"].to_numpy(),
+            "Members": member[rows, :len(series_runs)].sum(axis=0),
+            "Entered": entered[rows, :len(series_runs)].sum(axis=0),
+            "Exited": exited[rows, :len(series_runs)].sum(axis=0),
+        }))
+    churn = pd.concat(frames).set_index(["series", "run_date"])
+    churn["Turnover"] = churn["Exited"] / churn.groupby(level="series")["Members"].shift(1)
+    return churn
+
+
+def get_spells(member, entered, exited, keys, runs):
+    """ One row per uninterrupted spell of a symbol in the selection, with its entry date, exit
+    date (the first run it was no longer selected, empty if still selected in the last run) and
+    its duration in runs and in days up to the exit date. The days of a spell still open are not
+    known yet and left empty. Entries and exits of a symbol alternate, so the spells pair the
+    n-th entry with the n-th exit, the open spells exiting past the last run.
+    """
+    entry_key, entry_run = np.nonzero(entered)
+    last_run = keys["runs"].to_numpy() - 1
+    still_open = member[np.arange(len(keys)), last_run]
+    exit_key, exit_run = np.nonzero(exited)
+    exit_key = np.concatenate([exit_key, np.flatnonzero(still_open)])
+    exit_run = np.concatenate([exit_run, last_run[still_open] + 1])
+    exit_run = exit_run[np.lexsort((exit_run, exit_key))]
+
+    run_dates = runs.set_index(["series", "run"])["run_date"]
+    series = keys["series"].to_numpy()[entry_key]
+    entry_date = run_dates.reindex(pd.MultiIndex.from_arrays([series, entry_run])).to_numpy()
+    exit_date = run_dates.reindex(pd.MultiIndex.from_arrays([series, exit_run])).to_numpy()
+    return pd.DataFrame({
+        "series": series,
+        "Symbol": keys["Symbol"].to_numpy()[entry_key],
+        "entry_date": entry_date,
+        "exit_date": exit_date,
+        "runs": exit_run - entry_run,
+        "days": (exit_date - entry_date) / np.timedelta64(1, "D"),
+    })
+
+
+def get_survival(spells):
+    """ Summary of the spell durations per series. Spells still open in the last run are counted
+    in runs with their duration so far, and left out of the days, which are not known yet.
+    """
+    return spells.assign(open=spells["exit_date"].isna()).groupby("series").agg(
+        Spells=("runs", "count"),
+        Open=("open", "sum"),
+        **{ "Median Runs": ("runs", "median"), "Mean Runs": ("runs", "mean"),
+            "Median Days": ("days", "median"), "Mean Days": ("days", "mean") })
+
+
+screens = [get_screen(spec) for spec in (args.screen or ["default"])]
+df = load_snapshots(args.filenames)
+key_codes, run_codes, keys, runs = index_snapshots(df)
+
+churn, spells, survival = {}, {}, {}
+for name, screen in screens:
+    membership = get_membership(screen(df).to_numpy(), key_codes, run_codes, keys)
+    churn[name] = get_churn(*membership, keys, runs)
+    spells[name] = get_spells(*membership, keys, runs)
+    survival[name] = get_survival(spells[name])
+churn = pd.concat(churn, names=["screen"])
+spells = pd.concat(spells, names=["screen"]).droplevel(-1).reset_index()
+survival = pd.concat(survival, names=["screen"])
+
+if args.output:
+    churn.to_csv("%s-churn.csv" % args.output)
+    spells.to_csv("%s-spells.csv" % args.output, index=False)
+    survival.to_csv("%s-survival.csv" % args.output)
+else:
+    print(churn.to_string())
+    print()
+    print(survival.to_string())
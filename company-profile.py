@@ -1,8 +1,8 @@
 import pandas as pd
 import numpy as np
-from scipy import stats
 import datetime
 import jinja2 as j2
+from robust_stats import get_robust_stats
 
 import argparse
 
@@ -68,12 +68,7 @@ def get_series_stats(series, years=5, dispersion_metrics=True):
         "ltm": series["LTM"] if "LTM" in series else series.iloc[-1],
     }
     if dispersion_metrics:
-        metrics.update({
-        "mean": series.mean(),
-        "std": series.std(),
-        "mean_z2": series[(np.abs(stats.zscore(series)) <= 2)].mean(),
-        "std_z2": series[(np.abs(stats.zscore(series)) <= 2)].std()
-    })
+        metrics.update(get_robust_stats(series, ["mean", "std", "mean_z2", "std_z2"]).to_dict())
     return metrics
 
 
@@ -161,7 +156,7 @@ def format_yy_growth_list(yy_growth: list):
 
 
 def collapse_to_single(serie):
-    return serie[(np.abs(stats.zscore(serie)) <= 2)].mean(),
+    return get_robust_stats(serie, ["mean_z2"])["mean_z2"]
     # if abs(serie.max() - serie.min()) < 0.1:
     #     return (serie.max() + serie.min()) / 2
     # else:
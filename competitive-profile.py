@@ -1,8 +1,16 @@
 import pandas as pd
 import numpy as np
-from scipy import stats
 import datetime
 import jinja2 as j2
+import robust_stats
+from robust_stats import get_robust_stats
+import tikr_panel
+from tikr_panel import parse_table, align_periods, get_file_hash
+import hashlib
+import os
+import pickle
+import sys
+import warnings
 from os import listdir
 from os.path import isfile, join
 from pathlib import Path
@@ -14,46 +22,15 @@ parser = argparse.ArgumentParser(
                     description='Produce HTML with processed financials from TIKR HTML full financials')
 parser.add_argument("-f", "--folder", help="Input folder with the competitors HTML")
 parser.add_argument("--format", default="html", nargs="?", choices=["html", "obsidian"], help="The output format. Default: html")
+parser.add_argument("--dtype", default="float64", choices=["float32", "float64"], help="Precision of the per-company series store. Default: float64")
+parser.add_argument("--align", default="calendar", choices=["calendar", "fiscal"], help="Align the peers' periods on the nearest calendar year or on their fiscal year. Default: calendar")
+parser.add_argument("--peer-median", action=argparse.BooleanOptionalAction, default=True, help="Add the peer median to the charts and tables")
+parser.add_argument("-m", "--manifest", metavar="FILENAME", help="Keep the per-company results in this file and only reparse added or changed files on the next run")
 
 args = parser.parse_args()
 
 j2_env = j2.Environment()
 
-def parse_date(x):
-    if x != "LTM":
-        date = datetime.datetime.strptime(x, "%m/%d/%y")
-        return str(date.year) + "-" + str(date.month)
-    return x
-
-
-def replacetonumbeR(s):
-    if type(s).__name__ == "str":
-        s = s.strip()
-        if s == "-":
-            s = 0
-        else:
-            s = s.replace("x", "")
-            s = s.replace(",","")
-            if s.find("(") >= 0 and s.find(")") >= 0:
-                s = s.replace("(","-").replace(")","")
-            if s.find("%") >= 0:
-                s = s.replace("%", "")
-                s = float(s) / 100
-    return s
-
-
-def parse_table(t):
-    t = t.dropna(how='all')
-    t = t.set_index(t.columns[0])
-    t = t.dropna(how='all', axis=1)
-    t = t.drop([c for c in t.index if "YoY" in c])
-    t = t.rename(columns=parse_date)
-    t = t.applymap(lambda x:replacetonumbeR(x))
-    t = t.astype(float)
-    t = t.fillna(0)
-    return t
-
-
 def get_growth_per_year(series, year):
     x = ((series.shift(-year) / series) ** (1 / year)) - 1
     x = x.dropna()
@@ -62,7 +39,7 @@ def get_growth_per_year(series, year):
 
 def get_series_stats(series, years=5, dispersion_metrics=True):
     metrics = { 
-        "series": list(series),
+        "series": series.to_numpy(),
         "yy_growth": [get_growth_per_year(series, i) for i in range(years, 0, -1)],
         "yy_growth_5": get_growth_per_year(series, 5),
         "yy_growth_3": get_growth_per_year(series, 3),
@@ -71,12 +48,7 @@ def get_series_stats(series, years=5, dispersion_metrics=True):
         "ltm": series["LTM"] if "LTM" in series else series.iloc[-1],
     }
     if dispersion_metrics:
-        metrics.update({
-        "mean": series.mean(),
-        "std": series.std(),
-        "mean_z2": series[(np.abs(stats.zscore(series)) <= 2)].mean(),
-        "std_z2": series[(np.abs(stats.zscore(series)) <= 2)].std()
-    })
+        metrics.update(get_robust_stats(series, ["mean", "std", "mean_z2", "std_z2"]).to_dict())
     return metrics
 
 
@@ -164,20 +136,21 @@ def format_yy_growth_list(yy_growth: list):
 
 
 def collapse_to_single(serie):
-    return serie[(np.abs(stats.zscore(serie)) <= 2)].mean()
+    return get_robust_stats(serie, ["mean_z2"])["mean_z2"]
+
+REPRESENTATIVE_ROWS = ["Total Revenues (CAGR)", "Gross Profit Margin %", "SG&A Margin %", "R&D Margin %", "EBIT Margin %",
+                       "Interest Expense Margin %", "Net Avail. For Common Margin %", "Levered Free Cash Flow Margin %",
+                       "Net Debt / EBITDA", "Return on Common Equity %", "Return On Equity %"]
 
-files = [join(args.folder, f) for f in listdir(args.folder) if isfile(join(args.folder, f))]
+SERIES_METRICS = ["gross-margin", "ebit-margin", "interest-margin", "net-margin", "fcf-margin", "debt", "fcf"]
 
-gross_margin_dict = {}
-ebit_margin_dict = {}
-interest_expense_margin_dict = {}
-net_margin_dict = {}
-levered_fcf_margin_dict = {}
-debt_dict = {}
-fcf_dict = {}
-representatives = {}
+MANIFEST_VERSION = 3
 
-for file in files:
+
+def parse_company(file):
+    """ Parse a single TIKR export into the per-company intermediate results: the period labels,
+    the metric x period array of the SERIES_METRICS and the row of representative values.
+    """
     dfs = pd.read_html(file)
 
     income = parse_table(dfs[0])
@@ -185,15 +158,6 @@ for file in files:
     # balance = parse_table(dfs[1])
     cashflow = parse_table(dfs[2])
     ratios = parse_table(dfs[3])
-    columns = ratios.columns
-    gross_margin_dict[Path(file).stem] = ratios.loc["Gross Profit Margin %"].tolist()
-    ebit_margin_dict[Path(file).stem] = ratios.loc["EBIT Margin %"].tolist()
-    net_margin_dict[Path(file).stem] = ratios.loc["Net Avail. For Common Margin %"].tolist()
-    levered_fcf_margin_dict[Path(file).stem] = ratios.loc["Levered Free Cash Flow Margin %"].tolist()
-    debt_dict[Path(file).stem] = ratios.loc["Net Debt / EBITDA"].tolist()
-    interest_expense_margin_dict[Path(file).stem] = pd.Series(name="Interest Expense Margin %", data=(-income.loc["interest expense"] / income.loc["total revenues"])).tolist()
-    fcf_dict[Path(file).stem] = cashflow.loc["Free Cash Flow"].tolist()
-
 
     rows = ["Gross Profit Margin %", "SG&A Margin %",
             lambda : pd.Series(name="R&D Margin %", data=(-income.loc["r&d expenses"] / income.loc["total revenues"])) if "r&d expenses" in income.index else pd.Series([], dtype=float, name="R&D Margin %"),
@@ -203,48 +167,146 @@ for file in files:
             "Levered Free Cash Flow Margin %",
             "Net Debt / EBITDA", "Return on Common Equity %", "Return On Equity %"]
 
-    representatives[Path(file).stem] = ([get_growth_per_year(income.loc["total revenues"], len(income.columns) - 1)] +
-                                        list(map(lambda x: collapse_to_single(x()) if callable(x) else collapse_to_single(ratios.loc[x]) if x in ratios.index else np.NaN, rows)))
-    
+    series = pd.DataFrame({
+        "gross-margin": ratios.loc["Gross Profit Margin %"],
+        "ebit-margin": ratios.loc["EBIT Margin %"],
+        "interest-margin": -income.loc["interest expense"] / income.loc["total revenues"],
+        "net-margin": ratios.loc["Net Avail. For Common Margin %"],
+        "fcf-margin": ratios.loc["Levered Free Cash Flow Margin %"],
+        "debt": ratios.loc["Net Debt / EBITDA"],
+        "fcf": cashflow.loc["Free Cash Flow"],
+    }, index=ratios.columns)
+
+    return {
+        "columns": ratios.columns.tolist(),
+        "series": series[SERIES_METRICS].to_numpy(dtype=np.float64).T,
+        "representative": ([get_growth_per_year(income.loc["total revenues"], len(income.columns) - 1)] +
+                           list(map(lambda x: collapse_to_single(x()) if callable(x) else collapse_to_single(ratios.loc[x]) if x in ratios.index else np.NaN, rows))),
+    }
+
+
+def build_series_store(companies, dtype=np.float64, align="calendar"):
+    """ Stack the per-company series into a single company x metric x period array. The
+    periods of all companies are aligned onto a common annual grid with a trailing LTM column
+    and scattered into the array in one pass. Periods a company does not report are left as
+    NaN and, should two periods of a company fall on the same year, the latest one is kept.
+    """
+    columns = [company["columns"] for company in companies.values()]
+    company_index = np.repeat(np.arange(len(companies)), [len(c) for c in columns])
+    years = align_periods(np.concatenate(columns), align)
+    values = np.concatenate([company["series"] for company in companies.values()], axis=1)
+
+    ltm = years == -1
+    grid = np.arange(years[~ltm].min(), years[~ltm].max() + 1)
+    period_index = np.where(ltm, len(grid), years - grid[0])
+
+    store = np.full((len(companies), len(SERIES_METRICS), len(grid) + ltm.any()), np.nan, dtype=dtype)
+    store[company_index, :, period_index] = values.T
+
+    labels = [("FY%d" if align == "fiscal" else "%d") % year for year in grid] + (["LTM"] if ltm.any() else [])
+    return list(companies.keys()), labels, store
+
+
+def get_peer_median(store):
+    """ Return the metric x period median across all companies of the series store.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        return np.nanmedian(store, axis=0)
+
+
+def to_list(values):
+    """ Return the values as a list of floats. Float32 values are given by their shortest repr,
+    e.g. 0.27 instead of the 0.27000001072883606 of their float64 expansion.
+    """
+    if values.dtype == np.float32:
+        return [float(np.format_float_positional(x, unique=True)) for x in values]
+    return values.tolist()
+
+
+def get_code_version():
+    """ Hash of the modules parse_company depends on, so that a change to the parsing or the
+    statistics code invalidates the manifest without having to bump MANIFEST_VERSION.
+    """
+    h = hashlib.sha1(str(MANIFEST_VERSION).encode())
+    for module in [__file__, robust_stats.__file__, tikr_panel.__file__]:
+        h.update(get_file_hash(module).encode())
+    return h.hexdigest()
+
+
+def load_manifest(filename):
+    if not filename or not isfile(filename):
+        return {}
+    with open(filename, "rb") as f:
+        manifest = pickle.load(f)
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("code") != get_code_version():
+        print("Manifest %s was built by another version of the code, reparsing all files" % filename, file=sys.stderr)
+        return {}
+    return manifest["files"]
+
+
+def save_manifest(filename, entries):
+    with open(filename, "wb") as f:
+        pickle.dump({ "version": MANIFEST_VERSION, "code": get_code_version(), "files": entries }, f)
+
+
+def update_manifest(files, entries):
+    """ Bring the manifest entries up to date with the given files. Files whose mtime and size
+    are unchanged are reused as is, touched files are reused if their content hash still
+    matches and only added or changed files are reparsed. Entries of removed files are dropped.
+    """
+    updated = {}
+    for file in files:
+        stat = os.stat(file)
+        entry = entries.get(file)
+        if entry is not None and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            updated[file] = entry
+            continue
+
+        file_hash = get_file_hash(file)
+        if entry is not None and entry["hash"] == file_hash:
+            updated[file] = { **entry, "mtime": stat.st_mtime_ns, "size": stat.st_size }
+            continue
+
+        print("Parsing %s" % file, file=sys.stderr)
+        updated[file] = { "mtime": stat.st_mtime_ns, "size": stat.st_size, "hash": file_hash, "company": parse_company(file) }
+
+    for file in entries.keys() - updated.keys():
+        print("Dropping %s" % file, file=sys.stderr)
+
+    return updated
+
+
+# Only the TIKR exports, so that a manifest kept in the folder is not taken for one
+files = [join(args.folder, f) for f in listdir(args.folder) if isfile(join(args.folder, f)) and f.endswith("html")]
+
+if args.manifest:
+    entries = update_manifest(files, load_manifest(args.manifest))
+    save_manifest(args.manifest, entries)
+    companies = { Path(file).stem: entries[file]["company"] for file in files }
+else:
+    companies = { Path(file).stem: parse_company(file) for file in files }
+
+names, labels, store = build_series_store(companies, dtype=np.dtype(args.dtype), align=args.align)
+peer_median = get_peer_median(store)
+representatives = { name: company["representative"] for name, company in companies.items() }
+
 metrics = {
-    "gross-margin": {
-        "title": "Gross Margins Comparison",
-        "labels": columns.tolist(),
-        "companies": gross_margin_dict
-    },
-    "ebit-margin": {
-        "title": "Operating Margins Comparison",
-        "labels": columns.tolist(),
-        "companies": ebit_margin_dict
-    },
-    "interest-margin": {
-        "title": "Interest Expense Margins Comparison",
-        "labels": columns.tolist(),
-        "companies": interest_expense_margin_dict
-    },
-    "net-margin": {
-        "title": "Net Margins Comparison",
-        "labels": columns.tolist(),
-        "companies": net_margin_dict
-    },
-    "fcf-margin": {
-        "title": "Levered FCF Margins Comparison",
-        "labels": columns.tolist(),
-        "companies": levered_fcf_margin_dict
-    },
-    "debt": {
-        "title": "Net Debt / EBITDA",
-        "labels": columns.tolist(),
-        "companies": debt_dict
-    },
-    # "fcf": {
-    #     "title": "FCF Comparison",
-    #     "labels": columns.tolist(),
-    #     "companies": fcf_dict
-    # },
+    "gross-margin": { "title": "Gross Margins Comparison" },
+    "ebit-margin": { "title": "Operating Margins Comparison" },
+    "interest-margin": { "title": "Interest Expense Margins Comparison" },
+    "net-margin": { "title": "Net Margins Comparison" },
+    "fcf-margin": { "title": "Levered FCF Margins Comparison" },
+    "debt": { "title": "Net Debt / EBITDA" },
+    # "fcf": { "title": "FCF Comparison" },
 }
+for key in metrics:
+    metrics[key]["labels"] = labels
+    metrics[key]["companies"] = { name: to_list(store[i, SERIES_METRICS.index(key)]) for i, name in enumerate(names) }
+    if args.peer_median:
+        metrics[key]["median"] = to_list(peer_median[SERIES_METRICS.index(key)])
 
-representatives = pd.DataFrame(representatives, index=(["Total Revenues (CAGR)"] + [r().name if callable(r) else r for r in rows])).T
+representatives = pd.DataFrame(representatives, index=REPRESENTATIVE_ROWS).T
 for col in representatives.columns:
     if col == "Net Debt / EBITDA":
         representatives[col] = representatives[col].apply("{:.1f}x".format)
@@ -258,7 +320,10 @@ if args.format == "html":
 
 if args.format == "obsidian":
     for key in metrics:
-        metrics[key]["companies"] = pd.DataFrame(metrics[key]["companies"], index=columns).T.to_markdown()
+        companies_table = pd.DataFrame(list(metrics[key]["companies"].values()), index=names, columns=labels)
+        if args.peer_median:
+            companies_table.loc["Peer Median"] = metrics[key]["median"]
+        metrics[key]["companies"] = companies_table.to_markdown()
     with open("competitive-profile.md.j2") as f:
         template = j2_env.from_string(f.read())
         print(template.render(metrics=metrics, representatives=representatives.to_markdown(), rdate=datetime.datetime.today().strftime('%Y-%m-%d')))
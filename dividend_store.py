@@ -0,0 +1,113 @@
+import datetime
+import os
+import pandas as pd
+import numpy as np
+from robust_stats import get_zscore_mask
+
+# The raw dividend histories of a scratch run, kept so that the dividend columns can be
+# recomputed for another window without going back to the network. All the histories are
+# concatenated into contiguous dates / amounts arrays, sorted by date within each symbol, and
+# the history of the i-th symbol is dates[offsets[i]:offsets[i + 1]].
+
+DIVIDEND_COLUMNS = ["Growth Tot", "Growth Y/Y", "Growth 5Y/Y", "Growth 3Y/Y", "Growth 1Y/Y", "Years", "Missing Years", "Outliers"]
+
+
+def save_dividend_store(path, histories):
+    """ Save the {symbol: div_df} histories, as returned by yfinance, in the store directory.
+    Dates are kept as the local calendar day of the dividend.
+    """
+    symbols = sorted(histories.keys())
+    dates = [histories[s]["Date"].dt.tz_localize(None).to_numpy().astype("datetime64[D]") for s in symbols]
+    amounts = [histories[s]["Dividends"].to_numpy(dtype=np.float64) for s in symbols]
+    order = [np.argsort(d, kind="stable") for d in dates]
+
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, "symbols.npy"), np.array(symbols, dtype=str))
+    np.save(os.path.join(path, "offsets.npy"), np.concatenate([[0], np.cumsum([len(d) for d in dates])]).astype(np.int64))
+    np.save(os.path.join(path, "dates.npy"), np.concatenate([d[o] for d, o in zip(dates, order)] + [np.array([], dtype="datetime64[D]")]))
+    np.save(os.path.join(path, "amounts.npy"), np.concatenate([a[o] for a, o in zip(amounts, order)] + [np.array([], dtype=np.float64)]))
+
+
+def load_dividend_store(path):
+    """ Memory-map the store directory. Returns the symbols, offsets, dates and amounts arrays.
+    """
+    return tuple(np.load(os.path.join(path, "%s.npy" % name), mmap_mode="r") for name in ["symbols", "offsets", "dates", "amounts"])
+
+
+def get_last_growth_per_year(values, years):
+    """ The row-wise get_growth_per_year of scratch.py over right-aligned yearly values, with the
+    number of years given per row: the last non-NaN ((v[t + years] / v[t]) ** (1 / years)) - 1.
+    """
+    rows = np.arange(len(values))
+    result = np.full(len(values), np.NaN)
+    for y in np.unique(years):
+        if y <= 0 or y >= values.shape[1]:
+            continue
+        subset = rows[years == y]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            growth = ((values[subset, y:] / values[subset, :-y]) ** (1 / y)) - 1
+        valid = ~np.isnan(growth)
+        last = growth.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+        result[subset] = np.where(valid.any(axis=1), growth[np.arange(len(subset)), last], np.NaN)
+    return result
+
+
+def get_dividend_stats_window(store, years_of_analysis=10, end_date=None):
+    """ Recompute the dividend columns of scratch.py for every symbol of the store at once, over
+    the years_of_analysis years up to end_date (last December 31st by default). Dividends are
+    summed per calendar year like get_dividend_stats, and symbols with 5 years of dividends or
+    less get the same "Too few dividends" comment.
+    """
+    if years_of_analysis < 5:
+        raise ValueError("We only do analysis of 5 or more years")
+    symbols, offsets, dates, amounts = store
+    end_date = end_date or datetime.date(datetime.date.today().year - 1, 12, 31)
+    start_date = pd.Timestamp(end_date) - pd.DateOffset(years=years_of_analysis + 1)
+
+    symbol_index = np.repeat(np.arange(len(symbols)), np.diff(offsets))
+    in_window = (dates >= np.datetime64(start_date.date(), "D")) & (dates <= np.datetime64(end_date, "D"))
+    symbol_index = symbol_index[in_window]
+    years = dates[in_window].astype("datetime64[Y]").astype(int) + 1970
+
+    # Histories are sorted by date within each symbol, so each (symbol, year) is a contiguous run
+    starts = np.flatnonzero(np.r_[True, (symbol_index[1:] != symbol_index[:-1]) | (years[1:] != years[:-1])])
+    group_symbol = symbol_index[starts]
+    group_year = years[starts]
+    group_total = np.add.reduceat(np.asarray(amounts)[in_window], starts) if len(starts) else np.array([])
+
+    counts = np.bincount(group_symbol, minlength=len(symbols))
+    width = max(counts.max(initial=0), 1)
+    first = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    column = width - counts[group_symbol] + (np.arange(len(starts)) - first[group_symbol])
+    values = np.full((len(symbols), width), np.NaN)
+    values[group_symbol, column] = group_total
+    year_values = np.full((len(symbols), width), np.NaN)
+    year_values[group_symbol, column] = group_year
+
+    rows = np.arange(len(symbols))
+    year_10 = np.where(counts > years_of_analysis, years_of_analysis, counts - 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth_tot = values[:, -1] / values[rows, np.clip(width - 1 - year_10, 0, width - 1)] - 1
+    missing_years = year_values[:, -1] - year_values[rows, np.clip(width - counts, 0, width - 1)] + 1 - counts
+
+    outliers = ~get_zscore_mask(values) & ~np.isnan(values)
+    outlier_records = [[] for _ in rows]
+    for r, c in zip(*np.nonzero(outliers)):
+        outlier_records[r].append({ "Date": int(year_values[r, c]), "Dividends": float(values[r, c]) })
+
+    df = pd.DataFrame({
+        "Symbol": np.asarray(symbols),
+        "Growth Tot": growth_tot,
+        "Growth Y/Y": get_last_growth_per_year(values, year_10),
+        "Growth 5Y/Y": get_last_growth_per_year(values, np.full(len(symbols), 5)),
+        "Growth 3Y/Y": get_last_growth_per_year(values, np.full(len(symbols), 3)),
+        "Growth 1Y/Y": get_last_growth_per_year(values, np.full(len(symbols), 1)),
+        "Years": year_10,
+        "Missing Years": missing_years,
+        "Outliers": outlier_records,
+    })
+
+    too_few = counts <= 5
+    df.loc[too_few, DIVIDEND_COLUMNS] = np.NaN
+    df["comment"] = np.where(too_few, [("Too few dividends (%s years)" % c) for c in counts], "ok")
+    return df
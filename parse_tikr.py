@@ -1,8 +1,8 @@
 import pandas as pd
 import numpy as np
-from scipy import stats
 import datetime
 import jinja2 as j2
+from robust_stats import get_robust_stats
 
 import argparse
 
@@ -66,12 +66,7 @@ def get_series_stats(series, years=5, dispersion_metrics=True):
         "ltm": series["LTM"] if "LTM" in series else series.iloc[-1],
     }
     if dispersion_metrics:
-        metrics.update({
-        "mean": series.mean(),
-        "std": series.std(),
-        "mean_z2": series[(np.abs(stats.zscore(series)) <= 2)].mean(),
-        "std_z2": series[(np.abs(stats.zscore(series)) <= 2)].std()
-    })
+        metrics.update(get_robust_stats(series, ["mean", "std", "mean_z2", "std_z2"]).to_dict())
     return metrics
 
 def get_dividends(income):
@@ -0,0 +1,77 @@
+import pandas as pd
+import numpy as np
+import argparse
+
+parser = argparse.ArgumentParser(
+                    prog='rank_data',
+                    description='Rank the companies of the scratch analysis against their sector peers')
+parser.add_argument("filename", help="Input CSV file containing the parsed metrics")
+parser.add_argument("-o", "--output", metavar="FILENAME", help="Output CSV file. If left empty, the CSV is printed")
+parser.add_argument("--level", default="industry", choices=["sector", "industry"], help="Group peers by sector or by sector and industry. Default: industry")
+
+args = parser.parse_args()
+
+# The metrics to rank on and whether a higher value is better
+RANKED_METRICS = {
+    "Net Margin": True,
+    "ROE": True,
+    "Debt Ratio": False,
+    "CapEx Ratio": False,
+    "Growth Y/Y": True,
+}
+
+# Ratios over the net income, which turn negative with losses instead of getting worse
+EARNINGS_RATIOS = ["Debt Ratio", "CapEx Ratio"]
+
+
+def get_peer_groups(df, level="industry"):
+    """ Return the peer group of each row. The Sector column of the scratch analysis holds
+    "<sector> - <industry>", so the sector level keeps only the part before the separator.
+    """
+    groups = df["Sector"].astype("string").replace("", pd.NA)
+    if level == "sector":
+        groups = groups.str.split(" - ", n=1).str[0]
+    return groups
+
+
+def rank_peers(df, groups):
+    """ Add the per-group percentile and z-score of each of the RANKED_METRICS, the composite
+    score (the mean of the percentiles, flipped for metrics where lower is better) and the rank
+    within the group. Rows without a group or without a metric are left out of its ranking.
+    The EARNINGS_RATIOS of companies with losses (Net Margin <= 0) are ranked last and left
+    out of the z-scores.
+    """
+    metrics = df[list(RANKED_METRICS)].replace([np.inf, -np.inf], np.NaN)
+    losses = (df["Net Margin"] <= 0).to_numpy()[:, None] & metrics[EARNINGS_RATIOS].notna()
+    ranked = metrics.copy()
+    ranked[EARNINGS_RATIOS] = metrics[EARNINGS_RATIOS].mask(losses, np.inf)
+    metrics[EARNINGS_RATIOS] = metrics[EARNINGS_RATIOS].mask(losses)
+    grouped = metrics.groupby(groups)
+
+    pctl = ranked.groupby(groups).rank(pct=True)
+    zscore = (metrics - grouped.transform("mean")) / grouped.transform("std")
+    score = ranked.mul(pd.Series(RANKED_METRICS).map({ True: 1, False: -1 })).groupby(groups).rank(pct=True)
+
+    df = df.copy()
+    df["Peer Group"] = groups
+    df["Peer Count"] = groups.map(groups.value_counts())
+    for metric in RANKED_METRICS:
+        df["%s Pctl" % metric] = pctl[metric]
+        df["%s Z" % metric] = zscore[metric]
+    df["Composite Score"] = score.mean(axis=1)
+    df["Peer Rank"] = df.groupby(groups)["Composite Score"].rank(ascending=False, method="min")
+    return df
+
+
+df = pd.read_csv(args.filename)
+for metric in RANKED_METRICS:
+    if metric not in df:
+        df[metric] = np.NaN
+
+df = rank_peers(df, get_peer_groups(df, args.level))
+df = df.sort_values(by=["Peer Group", "Peer Rank"])
+
+if args.output:
+    df.to_csv("%s" % args.output, index=False)
+else:
+    print(df.to_csv(None, index=False))
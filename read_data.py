@@ -1,6 +1,9 @@
 import pandas as pd
+import numpy as np
+import json
 import argparse
 import jinja2 as j2
+from screens import SCREENS
 
 j2_env = j2.Environment()
 
@@ -9,39 +12,64 @@ parser = argparse.ArgumentParser(
                     description='Produce HTML from CSV file with financial metrics')
 parser.add_argument("filename", help="Input CSV file containing the parsed metrics")
 parser.add_argument("--filter", action=argparse.BooleanOptionalAction, default=True, help="Apply any filters to dataset")
+parser.add_argument("--format", default="html", choices=["html", "compact"], help="Render a plain HTML table, or a compact table rendered in the browser for large datasets. Default: html")
 
 args = parser.parse_args()
 
+FORMATS = {
+    'Growth Tot': '{:,.2%}',
+    'Growth Y/Y': '{:,.2%}',
+    'Growth 3Y/Y': '{:,.2%}',
+    'Growth 5Y/Y': '{:,.2%}',
+    'Growth 1Y/Y': '{:,.2%}',
+    'Years': '{:.0f}',
+    'Missing Years': '{:.0f}',
+    'Net Margin': '{:,.2%}',
+    'Debt Ratio': '{:,.2}',
+    'ROE': '{:,.2%}',
+    'Current Ratio': '{:,.2}',
+    'Share Growth 3Y/Y': '{:,.2%}',
+    'CapEx Ratio': '{:,.2%}',
+    'Peer Count': '{:.0f}',
+    'Composite Score': '{:,.2%}',
+    'Peer Rank': '{:.0f}',
+}
+
+
+def to_json_column(series, digits=6):
+    """ Return the column as a JSON array, with numbers kept to the given significant digits and
+    NaN or infinite values as null.
+    """
+    if pd.api.types.is_numeric_dtype(series):
+        values = series.map(("{:.%dg}" % digits).format).where(np.isfinite(series), "null")
+        return "[%s]" % ",".join(values)
+    return json.dumps(series.astype(object).where(series.notna(), None).tolist())
+
+
 df = pd.read_csv(args.filename)
 
 if args.filter:
-    df = df[df["comment"] == "ok"]
-    df = df[df["Net Margin"] > 0]
-    df = df[df["Debt Ratio"] < 5]
-    df = df[df["ROE"] > 0]
-    df = df[df["Sector"].str.contains("Financial Services") == False]
+    df = df[SCREENS["default"](df)]
     df = df.drop(columns=["comment"])
 
 cols = list(df.columns[0:list(df.columns).index("Outliers")]) + list(df.columns[list(df.columns).index("Outliers") + 1:]) + ["Outliers"]
 df = df[cols]
 df = df.sort_values(by="Symbol")
 
-with open("template.html.j2") as f:
-    template = j2_env.from_string(f.read())
-print(template.render(table=df
-                              .set_axis(range(1, len(df)+1))
-                              .to_html(index=True, classes=["table", "table-sm", "table-hover", "text-center", "text-nowrap"], formatters={
-    'Growth Tot': '{:,.2%}'.format,
-    'Growth Y/Y': '{:,.2%}'.format,
-    'Growth 3Y/Y': '{:,.2%}'.format,
-    'Growth 5Y/Y': '{:,.2%}'.format,
-    'Growth 1Y/Y': '{:,.2%}'.format,
-    'Years': '{:.0f}'.format,
-    'Missing Years': '{:.0f}'.format,
-    'Net Margin': '{:,.2%}'.format,
-    'Debt Ratio': '{:,.2}'.format,
-    'ROE': '{:,.2%}'.format,
-    'Current Ratio': '{:,.2}'.format,
-    'Share Growth 3Y/Y': '{:,.2%}'.format,
-    'CapEx Ratio': '{:,.2%}'.format,
-})).replace("text-align: right", ""))
+if args.format == "html":
+    with open("template.html.j2") as f:
+        template = j2_env.from_string(f.read())
+    print(template.render(table=df
+                                  .set_axis(range(1, len(df)+1))
+                                  .to_html(index=True, classes=["table", "table-sm", "table-hover", "text-center", "text-nowrap"], formatters={
+        column: spec.format for column, spec in FORMATS.items()
+    })).replace("text-align: right", ""))
+
+if args.format == "compact":
+    # The data is embedded once column by column and formatted and rendered in the browser,
+    # only for the rows in view, so the report stays small for unfiltered datasets
+    data = '{"columns":%s,"values":[%s],"formats":%s}' % (json.dumps(df.columns.tolist()), ",".join(to_json_column(df[c]) for c in df.columns), json.dumps(FORMATS))
+    data = data.replace("</", "<\\/")
+    with open("template-compact.html.j2") as f:
+        template = j2_env.from_string(f.read())
+    print(template.render(data=data, row_height=33))
@@ -0,0 +1,36 @@
+import datetime
+import pandas as pd
+import numpy as np
+import argparse
+from dividend_store import DIVIDEND_COLUMNS, load_dividend_store, get_dividend_stats_window
+
+parser = argparse.ArgumentParser(
+                    prog='recompute_dividends',
+                    description='Recompute the dividend columns of the scratch analysis for another window from the stored dividend histories')
+parser.add_argument("store", help="Directory of the dividend histories, as written by scratch.py --dividends")
+parser.add_argument("-y", "--years", type=int, default=10, help="Years of analysis. Default: 10")
+parser.add_argument("--end", type=datetime.date.fromisoformat, help="Last day of the analysis (YYYY-MM-DD). Default: December 31st of last year")
+parser.add_argument("-b", "--base", metavar="FILENAME", help="Scratch CSV whose dividend columns are replaced. If left empty, only the dividend columns are output")
+parser.add_argument("-o", "--output", metavar="FILENAME")
+
+args = parser.parse_args()
+
+df = get_dividend_stats_window(load_dividend_store(args.store), years_of_analysis=args.years, end_date=args.end)
+df["Outliers"] = df["Outliers"].map(lambda x: x if isinstance(x, float) else str(x))
+
+if args.base:
+    base = pd.read_csv(args.base).set_index("Symbol")
+    df = df.set_index("Symbol")
+    symbols = base.index.intersection(df.index)
+    # Rows that did not succeed in the base run have no financial columns, as the dividends are
+    # checked first, so they are not complete results even if the new window has enough dividends
+    comment = df.loc[symbols, "comment"].where((df.loc[symbols, "comment"] != "ok") | (base.loc[symbols, "comment"] == "ok"), "ok (dividends only)")
+    base = base.astype({ c: np.result_type(base[c].dtype, df[c].dtype) for c in DIVIDEND_COLUMNS })
+    base.loc[symbols, DIVIDEND_COLUMNS] = df.loc[symbols, DIVIDEND_COLUMNS]
+    base.loc[symbols, "comment"] = comment
+    df = base.reset_index()
+
+if args.output:
+    df.to_csv("%s" % args.output, index=False)
+else:
+    print(df.to_csv(None, index=False))
@@ -0,0 +1,60 @@
+import warnings
+import pandas as pd
+import numpy as np
+
+ROBUST_AGGREGATES = ["mean", "std", "mean_z2", "std_z2", "trimmed_mean", "median", "mad"]
+
+
+def get_zscore_mask(values, z=2):
+    """ Return the mask of the values within z standard deviations of their row mean, the same
+    as np.abs(stats.zscore(values)) <= z but ignoring NaN. Rows with zero variance are kept
+    whole instead of being dropped because of the 0 / 0 z-score. NaN values are never kept.
+    """
+    x = np.atleast_2d(np.asarray(values, dtype=float))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        mean = np.nanmean(x, axis=1, keepdims=True)
+        std = np.nanstd(x, axis=1, keepdims=True)
+    deviation = np.abs(x - mean)
+    mask = np.where(std > 0, deviation <= z * std, deviation == 0)
+    return mask.reshape(np.shape(values))
+
+
+def get_robust_stats(values, aggregates=ROBUST_AGGREGATES, z=2, t=0.02):
+    """ Compute the requested aggregates of a 1-D series, or row-wise for a 2-D block such as a
+    whole statements table. NaN values are ignored and the z-score mask and the quantiles are
+    computed once for all aggregates:
+        - mean, std: plain mean and sample standard deviation
+        - mean_z2, std_z2: mean and sample standard deviation after dropping |z| > z
+        - trimmed_mean: mean of the values between the t and 1 - t quantiles
+        - median, mad: median and median absolute deviation from it
+    Returns a Series indexed by the aggregates for 1-D input, otherwise a DataFrame with one
+    row per input row.
+    """
+    x = np.asarray(values, dtype=float)
+    one_dimensional = x.ndim == 1
+    x = np.atleast_2d(x)
+    if x.shape[1] == 0:
+        x = np.full((x.shape[0], 1), np.NaN)
+
+    result = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        if "mean" in aggregates:
+            result["mean"] = np.nanmean(x, axis=1)
+        if "std" in aggregates:
+            result["std"] = np.nanstd(x, axis=1, ddof=1)
+        if "mean_z2" in aggregates or "std_z2" in aggregates:
+            inliers = np.where(get_zscore_mask(x, z), x, np.NaN)
+            result["mean_z2"] = np.nanmean(inliers, axis=1)
+            result["std_z2"] = np.nanstd(inliers, axis=1, ddof=1)
+        if "trimmed_mean" in aggregates:
+            qlow, qhigh = np.nanquantile(x, [t, 1 - t], axis=1, keepdims=True)
+            result["trimmed_mean"] = np.nanmean(np.where((x >= qlow) & (x <= qhigh), x, np.NaN), axis=1)
+        if "median" in aggregates or "mad" in aggregates:
+            median = np.nanmedian(x, axis=1, keepdims=True)
+            result["median"] = median[:, 0]
+            result["mad"] = np.nanmedian(np.abs(x - median), axis=1)
+
+    result = pd.DataFrame(result, index=values.index if isinstance(values, pd.DataFrame) else None)[list(aggregates)]
+    return result.iloc[0].rename(getattr(values, "name", None)) if one_dimensional else result
@@ -1,11 +1,16 @@
 import sys
+import os
+import socket
+import time
 import yfinance as yf
 import pandas as pd
 import numpy as np
-from scipy import stats
 import datetime
 import pytz
 import argparse
+from robust_stats import get_robust_stats, get_zscore_mask
+from dividend_store import save_dividend_store
+from work_queue import open_queue, enqueue_symbols, claim_batch, heartbeat, complete_symbol, release_worker, count_remaining, get_next_expiry, get_results
 
 parser = argparse.ArgumentParser(
                     prog='scratch',
@@ -13,6 +18,12 @@ parser = argparse.ArgumentParser(
 parser.add_argument("-f", "--filename", help="CSV file of symbols of companies to perform the search. The file should be ';' separated")
 parser.add_argument("-e", "--exchanges", default="", help="A comma-separated list of the exchanges to search for the stock. If left empty, the symbol will be search at the most common.")
 parser.add_argument("-o", "--output", metavar="FILENAME")
+parser.add_argument("-d", "--dividends", metavar="DIRECTORY", help="Keep the raw dividend histories in this store, to recompute the dividend columns for other windows with recompute_dividends.py")
+parser.add_argument("-q", "--queue", metavar="FILENAME", help="SQLite work queue shared by any number of workers. The symbols of --filename are added to it and the process works it until all its symbols are done, including those of crashed workers")
+parser.add_argument("--work", action=argparse.BooleanOptionalAction, default=True, help="Process symbols from the queue. Use --no-work to only enqueue or merge")
+parser.add_argument("--merge", action="store_true", help="Write the output from the results of the queue, once all its symbols are done")
+parser.add_argument("--batch-size", type=int, default=10, help="Number of symbols a worker claims from the queue at a time. Default: 10")
+parser.add_argument("--lease", type=int, default=300, help="Seconds after which the symbols of an unresponsive worker are claimed again. Default: 300")
 
 args = parser.parse_args()
 
@@ -48,7 +59,7 @@ def get_dividend_stats(symbol, div_df, years_of_analysis=10):
         "Growth 1Y/Y": get_growth_per_year(div_df_10yrs_grouped["Dividends"], 1),
         "Years": year_10,
         "Missing Years": missing_dividend_years.count(),
-        "Outliers": div_df_10yrs_grouped[(np.abs(stats.zscore(div_df_10yrs_grouped["Dividends"])) > 2)].to_dict(orient="records"),
+        "Outliers": div_df_10yrs_grouped[~get_zscore_mask(div_df_10yrs_grouped["Dividends"])].to_dict(orient="records"),
     }
 
 
@@ -81,9 +92,7 @@ def get_net_debt(balance):
 def get_trimmed_mean(series, t=0.02):
     """ Return the trimmed mean over the given series.
     """
-    qlow = series.quantile(t)
-    qhigh = series.quantile(1 - t)
-    return series[(series >= qlow) & (series <= qhigh)].mean()
+    return get_robust_stats(series, ["trimmed_mean"], t=t)["trimmed_mean"]
 
 
 def get_net_income_margins_mean(income, t=0.02):
@@ -93,9 +102,11 @@ def get_net_income_margins_mean(income, t=0.02):
     return get_trimmed_mean(x, t)
 
 
-def parse_stock(symbol, exchanges):
+def parse_stock(symbol, exchanges, histories=None):
     company = get_ticker_from_symbol(symbol, exchanges)
     div_df = pd.DataFrame(company.dividends).reset_index().sort_values(by="Date")
+    if histories is not None:
+        histories[company.ticker] = div_df
     result = get_dividend_stats(company.ticker, div_df)
 
     balance = company.balance_sheet.sort_index(axis=1)
@@ -120,32 +131,83 @@ def parse_stock(symbol, exchanges):
 
     return result
 
-datas = []
+def process_stock(symbol, name, exchanges, histories=None):
+    print("Retrieving dividend data for:", name, "(%s)" % symbol)
+    try:
+        data = parse_stock(symbol, exchanges=exchanges, histories=histories)
+        return { **data, "comment": "ok" }
+    except DividendException as e:
+        return { "Symbol": e.args[0]["Symbol"], "comment": e.args[0]["error"] }
+    except Exception as e:
+        print("Could not process symbol %s" % symbol)
+        print(e)
+        return { "Symbol": symbol, "comment": "Exception when parsing" }
+
+
+def work_queue(conn, exchanges, batch_size=10, lease=300, poll=30):
+    """ Claim batches of symbols from the queue and store their results until all the symbols
+    are done. The lease is renewed after each symbol, so only a crashed worker loses its batch.
+    While other workers still hold leases, the worker waits (at most poll seconds at a time)
+    to take over the symbols of any of them that crashed once their lease expires.
+    """
+    worker = "%s-%s" % (socket.gethostname(), os.getpid())
+    try:
+        while True:
+            batch = claim_batch(conn, worker, batch_size, lease)
+            if not batch:
+                if not count_remaining(conn):
+                    break
+                next_expiry = get_next_expiry(conn)
+                time.sleep(min(max(next_expiry - time.time(), 1) if next_expiry else 1, poll))
+                continue
+            for position, symbol, name in batch:
+                histories = {}
+                data = process_stock(symbol, name, exchanges, histories)
+                complete_symbol(conn, position, (data, histories))
+                heartbeat(conn, worker, lease)
+    finally:
+        release_worker(conn, worker)
+
+
+stocks = None
 if args.filename == "-":
     stocks = pd.read_csv(sys.stdin, sep=";")
-elif args.filename.endswith("ods"):
+elif args.filename and args.filename.endswith("ods"):
     stocks = pd.read_excel(args.filename, engine="odf")
-else:
+elif args.filename:
     stocks = pd.read_csv(args.filename, sep=";")
 
-print("Found %s symbols" % len(stocks))
-print(stocks.head())
-if "Name" not in stocks:
-    stocks["Name"] = stocks["Symbol"]
+if stocks is not None:
+    print("Found %s symbols" % len(stocks))
+    print(stocks.head())
+    if "Name" not in stocks:
+        stocks["Name"] = stocks["Symbol"]
 
 exchanges = list(filter(lambda x: len(x), [e.strip() for e in args.exchanges.split(",")]))
 
-for index, stock in stocks.iterrows():
-    print("Retrieving dividend data for:", stock["Name"], "(%s)" % stock["Symbol"])
-    try:
-        data = parse_stock(stock["Symbol"], exchanges=exchanges)
-        datas.append({ **data, "comment": "ok" })
-    except DividendException as e:
-        datas.append({ "Symbol": e.args[0]["Symbol"], "comment": e.args[0]["error"] })
-    except Exception as e:
-        print("Could not process symbol %s" % stock["Symbol"])
-        print(e)
-        datas.append({ "Symbol": stock["Symbol"], "comment": "Exception when parsing" })
+if args.queue:
+    conn = open_queue(args.queue)
+    if stocks is not None:
+        try:
+            enqueue_symbols(conn, [(position, stock["Symbol"], stock["Name"]) for position, (_, stock) in enumerate(stocks.iterrows())])
+        except ValueError as e:
+            sys.exit("%s: %s" % (args.queue, e))
+    if args.work:
+        work_queue(conn, exchanges, batch_size=args.batch_size, lease=args.lease)
+    if not args.merge:
+        sys.exit(0)
+    remaining = count_remaining(conn)
+    if remaining:
+        sys.exit("%s symbols of the queue are not done yet" % remaining)
+    results = get_results(conn)
+    datas = [data for data, _ in results]
+    histories = { symbol: div_df for _, symbol_histories in results for symbol, div_df in symbol_histories.items() }
+else:
+    histories = {}
+    datas = [process_stock(stock["Symbol"], stock["Name"], exchanges, histories) for _, stock in stocks.iterrows()]
+
+if args.dividends:
+    save_dividend_store(args.dividends, histories)
 
 print("======= Printing Output =======")
 df = pd.DataFrame(datas)
@@ -0,0 +1,23 @@
+# Screens over the scratch analysis output. Each screen returns the boolean mask of the rows
+# it selects, so that it can be applied to a single run or to many runs at once.
+
+SCREENS = {
+    "default": lambda df: ((df["comment"] == "ok") &
+                           (df["Net Margin"] > 0) &
+                           (df["Debt Ratio"] < 5) &
+                           (df["ROE"] > 0) &
+                           (df["Sector"].str.contains("Financial Services") == False)),
+}
+
+
+def get_screen(spec):
+    """ Return the (name, screen) of a spec, either the name of one of the SCREENS or
+    "name=expression" with a pandas expression over the columns, e.g.
+    "growers=`Growth 5Y/Y` > 0.05 and ROE > 0.1".
+    """
+    if spec in SCREENS:
+        return spec, SCREENS[spec]
+    name, _, expression = spec.partition("=")
+    if not expression:
+        raise ValueError("Unknown screen %s. Use one of %s or name=expression" % (spec, ", ".join(SCREENS)))
+    return name, lambda df: df.eval(expression).eq(True)
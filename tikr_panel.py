@@ -0,0 +1,181 @@
+import datetime
+import hashlib
+import os
+import pickle
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from os import listdir
+from os.path import isfile, join
+from pathlib import Path
+import pandas as pd
+import numpy as np
+from robust_stats import get_robust_stats
+
+# Load a whole folder of TIKR full-financials exports into one panel: a DataFrame indexed by
+# (company, statement, line item) with the periods of all the companies aligned as columns,
+# so that a line item or a ratio across all the companies is a single selection.
+
+STATEMENTS = ["income", "balance", "cashflow", "ratios"]
+
+
+def parse_date(x):
+    if x != "LTM":
+        date = datetime.datetime.strptime(x, "%m/%d/%y")
+        return str(date.year) + "-" + str(date.month)
+    return x
+
+
+def replacetonumbeR(s):
+    if type(s).__name__ == "str":
+        s = s.strip()
+        if s == "-":
+            s = 0
+        else:
+            s = s.replace("x", "")
+            s = s.replace(",","")
+            if s.find("(") >= 0 and s.find(")") >= 0:
+                s = s.replace("(","-").replace(")","")
+            if s.find("%") >= 0:
+                s = s.replace("%", "")
+                s = float(s) / 100
+    return s
+
+
+def parse_table(t):
+    t = t.dropna(how='all')
+    t = t.set_index(t.columns[0])
+    t = t.dropna(how='all', axis=1)
+    t = t.drop([c for c in t.index if "YoY" in c])
+    t = t.rename(columns=parse_date)
+    t = t.applymap(lambda x:replacetonumbeR(x))
+    t = t.astype(float)
+    t = t.fillna(0)
+    return t
+
+
+def align_periods(labels, align="calendar"):
+    """ Map the parse_date labels (e.g. "2023-6") onto the years of a common annual grid. With
+    "fiscal" a period goes to the year its fiscal year ends in, with "calendar" to the nearest
+    calendar year, i.e. fiscal years ending January to June count towards the previous year.
+    LTM is kept out of the grid and mapped to -1.
+    """
+    labels = pd.Series(labels, dtype=str)
+    ltm = (labels == "LTM").to_numpy()
+    parts = labels.where(~ltm, "0-0").str.split("-", expand=True).astype(int).to_numpy()
+    years = parts[:, 0] - ((parts[:, 1] <= 6) if align == "calendar" else 0)
+    return np.where(ltm, -1, years)
+
+
+def read_tikr_tables(filename):
+    """ Parse the statements of a TIKR export, in the order of STATEMENTS.
+    """
+    dfs = pd.read_html(filename)
+    return { statement: parse_table(t) for statement, t in zip(STATEMENTS, dfs) }
+
+
+def read_tikr_tables_safe(filename):
+    try:
+        return read_tikr_tables(filename)
+    except Exception as e:
+        print("Skipping %s because exception was thrown: %s" % (filename, e), file=sys.stderr)
+        return None
+
+
+def get_file_hash(file):
+    h = hashlib.sha1()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_tikr_tables(files, cache=None, workers=None):
+    """ Parse the files in parallel processes, skipping the files that fail to parse. With a
+    cache directory, the parsed tables are kept there by content hash and only files not seen
+    before are parsed. The hash of this module is part of the key, so a change to the parsing
+    code does not serve tables parsed by the previous version.
+    """
+    cached = {}
+    if cache:
+        os.makedirs(cache, exist_ok=True)
+        code_hash = get_file_hash(__file__)[:12]
+        cache_files = { file: join(cache, "%s-%s.pkl" % (get_file_hash(file), code_hash)) for file in files }
+        for file, cache_file in cache_files.items():
+            if isfile(cache_file):
+                with open(cache_file, "rb") as f:
+                    cached[file] = pickle.load(f)
+
+    missing = [file for file in files if file not in cached]
+    parsed = {}
+    if missing:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parsed = dict(zip(missing, executor.map(read_tikr_tables_safe, missing)))
+
+    if cache:
+        for file, tables in parsed.items():
+            if tables is not None:
+                with open(cache_files[file], "wb") as f:
+                    pickle.dump(tables, f)
+
+    tables = { **cached, **parsed }
+    return { file: tables[file] for file in files if tables[file] is not None }
+
+
+def load_tikr_panel(folder, cache=None, workers=None, align="calendar"):
+    """ Load all the TIKR exports of the folder into a panel indexed by (company, statement, item)
+    with one column per year of the common grid, see align_periods, and a trailing LTM column.
+    The company is the file name without extension. Should a line item appear twice in a
+    statement, or two periods of a company fall on the same year, the first item and the last
+    period are kept.
+    """
+    files = sorted(join(folder, f) for f in listdir(folder) if isfile(join(folder, f)) and f.endswith("html"))
+
+    frames = {}
+    for file, tables in load_tikr_tables(files, cache=cache, workers=workers).items():
+        for statement, t in tables.items():
+            t = t[~t.index.duplicated()]
+            years = align_periods(t.columns, align)
+            keep = ~pd.Index(years).duplicated(keep="last")
+            t = t.loc[:, keep]
+            t.columns = ["LTM" if y == -1 else ("FY%d" if align == "fiscal" else "%d") % y for y in years[keep]]
+            frames[(Path(file).stem, statement)] = t
+
+    panel = pd.concat(frames, names=["company", "statement", "item"])
+    periods = sorted((c for c in panel.columns if c != "LTM"), key=lambda c: int(c.lstrip("FY")))
+    return panel[periods + (["LTM"] if "LTM" in panel.columns else [])]
+
+
+def get_line_item(panel, statement, item):
+    """ Return the company x period frame of a line item. Companies without it are left out.
+    """
+    return panel.xs((statement, item), level=("statement", "item"))
+
+
+# The comparisons of tikr.ipynb, with the same definitions as get_income_stats and
+# get_balance_stats, as functions of the panel returning a company x period frame
+PEER_METRICS = {
+    "net_income_margin": lambda p: get_line_item(p, "income", "Net Income to Common Excl. Extra Items") / get_line_item(p, "income", "Revenues"),
+    "interest_expense_margin": lambda p: -get_line_item(p, "income", "Interest Expense") / get_line_item(p, "income", "Operating Income"),
+    "dividends": lambda p: get_line_item(p, "income", "Dividends Per Share"),
+    "payout": lambda p: get_line_item(p, "income", "Dividends Per Share") * get_line_item(p, "income", "Weighted Average Diluted Shares Outstanding") / get_line_item(p, "income", "Net Income"),
+    "debt_to_earnings": lambda p: get_line_item(p, "balance", "Net Debt") / get_line_item(p, "income", "Net Income"),
+}
+
+
+def get_growth_tot(metric, years=10):
+    """ Row-wise growth of the last value over the value years periods before it.
+    """
+    return (metric / metric.shift(years, axis=1) - 1).ffill(axis=1).iloc[:, -1].rename("growth_tot")
+
+
+def get_peer_comparison(panel, years=10):
+    """ Return the comparison tables of tikr.ipynb for all the companies of the panel.
+    """
+    metrics = { name: metric(panel) for name, metric in PEER_METRICS.items() }
+    return {
+        "net_income_margin": get_robust_stats(metrics["net_income_margin"], ["mean", "mean_z2"]).sort_values(by="mean_z2", ascending=False),
+        "interest_expense_margin": get_robust_stats(metrics["interest_expense_margin"], ["mean", "mean_z2"]).sort_values(by="mean_z2", ascending=True),
+        "dps_growth": get_growth_tot(metrics["dividends"], years).to_frame().sort_values(by="growth_tot", ascending=False),
+        "debt_to_earnings": get_robust_stats(metrics["debt_to_earnings"], ["mean", "mean_z2"]).sort_values(by="mean_z2", ascending=True),
+        "payout": get_robust_stats(metrics["payout"], ["mean", "mean_z2"]).sort_values(by="mean_z2", ascending=True),
+    }
@@ -0,0 +1,98 @@
+import pickle
+import sqlite3
+import time
+
+# A work queue of symbols backed by a single SQLite file, so that any number of scratch
+# workers can share it without an external service. Workers claim batches of symbols under
+# a lease, renew it with a heartbeat while they work and store the result of each symbol.
+# The leases of crashed workers expire and their symbols are claimed again by the others.
+# Workers on several machines need the file on a shared filesystem with working locks.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS symbols (
+    position INTEGER PRIMARY KEY,
+    symbol TEXT NOT NULL,
+    name TEXT,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    result BLOB
+);
+CREATE INDEX IF NOT EXISTS symbols_state ON symbols (state, lease_expires);
+"""
+
+
+def open_queue(filename, timeout=60):
+    conn = sqlite3.connect(filename, timeout=timeout, isolation_level=None)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def enqueue_symbols(conn, stocks):
+    """ Add the (position, symbol, name) tuples to an empty queue. Enqueueing the same list
+    again is a no-op, so it does not redo finished work, but a queue holding another list of
+    symbols (e.g. the queue of a previous run) is refused with a ValueError rather than mixing
+    the results of both runs.
+    """
+    stocks = [(position, str(symbol), name if isinstance(name, str) else None) for position, symbol, name in stocks]
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        queued = conn.execute("SELECT position, symbol, name FROM symbols ORDER BY position").fetchall()
+        if queued and queued != stocks:
+            raise ValueError("The queue already holds %s other symbols, remove it to start a new run" % len(queued))
+        conn.executemany("INSERT OR IGNORE INTO symbols (position, symbol, name) VALUES (?, ?, ?)", stocks)
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def claim_batch(conn, worker, batch_size=10, lease=300):
+    """ Lease up to batch_size pending symbols, or symbols whose lease has expired, to the
+    worker. Returns the claimed (position, symbol, name) tuples in queue order.
+    """
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    rows = conn.execute("""SELECT position, symbol, name FROM symbols
+                           WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?)
+                           ORDER BY position LIMIT ?""", (now, batch_size)).fetchall()
+    conn.executemany("UPDATE symbols SET state = 'leased', worker = ?, lease_expires = ? WHERE position = ?",
+                     [(worker, now + lease, row[0]) for row in rows])
+    conn.execute("COMMIT")
+    return rows
+
+
+def heartbeat(conn, worker, lease=300):
+    """ Renew the lease of all the symbols the worker still holds.
+    """
+    conn.execute("UPDATE symbols SET lease_expires = ? WHERE state = 'leased' AND worker = ?", (time.time() + lease, worker))
+
+
+def complete_symbol(conn, position, result):
+    """ Store the result of a symbol. The first result stored wins, should the symbol have been
+    claimed again after its lease expired.
+    """
+    conn.execute("UPDATE symbols SET state = 'done', result = ?, lease_expires = NULL WHERE position = ? AND state != 'done'",
+                 (pickle.dumps(result), position))
+
+
+def release_worker(conn, worker):
+    """ Hand the symbols still leased to the worker back to the queue.
+    """
+    conn.execute("UPDATE symbols SET state = 'pending', worker = NULL, lease_expires = NULL WHERE state = 'leased' AND worker = ?", (worker,))
+
+
+def count_remaining(conn):
+    return conn.execute("SELECT COUNT(*) FROM symbols WHERE state != 'done'").fetchone()[0]
+
+
+def get_next_expiry(conn):
+    """ Return the time the first lease held by any worker expires, None if no symbol is leased.
+    """
+    return conn.execute("SELECT MIN(lease_expires) FROM symbols WHERE state = 'leased'").fetchone()[0]
+
+
+def get_results(conn):
+    """ Return the stored results in queue order.
+    """
+    return [pickle.loads(row[0]) for row in conn.execute("SELECT result FROM symbols WHERE state = 'done' ORDER BY position")]